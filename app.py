@@ -5,50 +5,108 @@ AI-powered waste classification server for image and text inputs
 """
 
 import os
-import io
 import logging
-from datetime import datetime
-from flask import Flask, request, jsonify
+import mmap
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from flask import Flask, request
 from flask_cors import CORS
 from PIL import Image
+from werkzeug.exceptions import HTTPException
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.applications import MobileNetV2
-from tensorflow.keras.preprocessing import image
-from werkzeug.utils import secure_filename
+
+from classification_core import (
+    KeywordMatcher, ResultCache, hash_bytes, hash_stream, hash_text, health_timestamp,
+    load_onnx_classifier, load_tflite_classifier, ojson, resize_image, sniff_image_type
+)
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(
+    level=logging.WARNING if os.getenv('FLASK_ENV') == 'production' else logging.INFO
+)
 logger = logging.getLogger(__name__)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+ALLOWED_EXTENSIONS = frozenset(('png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'))
+CACHE_SIZE = int(os.getenv('CLASSIFICATION_CACHE_SIZE', 4096))
+
+# Micro-batching of concurrent image predictions
+MAX_BATCH = int(os.getenv('MAX_BATCH', 16))
+MAX_WAIT_MS = int(os.getenv('MAX_WAIT_MS', 10))
+PREDICT_TIMEOUT = 30  # seconds
+
+# Oversized uploads are rejected by Werkzeug with a 413 before being read
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Classification results keyed by content hash
+image_cache = ResultCache(maxsize=CACHE_SIZE)
+text_cache = ResultCache(maxsize=CACHE_SIZE)
+
+# INT8 TFLite MobileNetV2 (built with convert_model.py)
+TFLITE_MODEL_PATH = os.getenv('TFLITE_MODEL_PATH', 'mbv2_int8.tflite')
+IMAGENET_LABELS_PATH = os.getenv('IMAGENET_LABELS_PATH', 'imagenet_labels.txt')
+
+# ONNX Runtime MobileNetV2, used when the TFLite model is not available
+ONNX_MODEL_PATH = os.getenv('ONNX_MODEL_PATH', 'mbv2_int8.onnx')
+
+# ImageNet class name fragments mapped to waste categories
+IMAGENET_WASTE_ITEMS = [
+    ('recyclable', 0.85, ['bottle', 'can', 'plastic', 'glass', 'paper', 'cardboard', 'container']),
+    ('biodegradable', 0.80, ['banana', 'apple', 'orange', 'fruit', 'food', 'vegetable']),
+    ('hazardous', 0.75, ['battery', 'electronic', 'chemical'])
+]
+CONTAINER_ITEMS = ['cup', 'bowl', 'plate', 'tray', 'box']
+
 # Global variables for ML models
 image_model = None
+tflite_model = None
+onnx_model = None
 waste_keywords = None
+keyword_matcher = None
+class_idx_to_waste = None
+container_class_idx = None
+
+def _imagenet_waste_category(class_name):
+    """Get the (category, confidence) for an ImageNet class name, or None"""
+    for category, confidence, items in IMAGENET_WASTE_ITEMS:
+        if any(item in class_name for item in items):
+            return category, confidence
+    return None
 
 def load_models():
     """Load and initialize ML models"""
-    global image_model, waste_keywords
+    global image_model, tflite_model, onnx_model, waste_keywords, keyword_matcher
+    global class_idx_to_waste, container_class_idx
     
     try:
-        # Load MobileNetV2 for image feature extraction
-        image_model = MobileNetV2(
-            weights='imagenet',
-            include_top=True,
-            input_shape=(224, 224, 3)
-        )
-        logger.info("MobileNetV2 model loaded successfully")
+        # Load the INT8 MobileNetV2 once and keep the interpreter warm
+        tflite_model = load_tflite_classifier(TFLITE_MODEL_PATH, IMAGENET_LABELS_PATH)
+        
+        if tflite_model is None:
+            onnx_model = load_onnx_classifier(ONNX_MODEL_PATH)
+        
+        if tflite_model is None and onnx_model is None:
+            # Fall back to the FP32 Keras model
+            logger.warning("Using FP32 MobileNetV2")
+            image_model = MobileNetV2(
+                weights='imagenet',
+                include_top=True,
+                input_shape=(224, 224, 3)
+            )
+            logger.info("MobileNetV2 model loaded successfully")
         
         # Define waste classification keywords
         waste_keywords = {
@@ -69,103 +127,207 @@ def load_models():
             ]
         }
         
+        keyword_matcher = KeywordMatcher(waste_keywords)
+        
         logger.info("Waste classification keywords loaded")
         
+        # Map every ImageNet class to a waste category once, instead of
+        # matching the top-5 class names against the item lists per request
+        if tflite_model is not None:
+            class_names = [name.lower() for name in tflite_model.labels]
+        else:
+            # decode_predictions of the identity matrix lists the names by index
+            decoded = tf.keras.applications.mobilenet_v2.decode_predictions(np.eye(1000), top=1)
+            class_names = [pred[0][1].lower() for pred in decoded]
+        
+        class_idx_to_waste = tuple(_imagenet_waste_category(name) for name in class_names)
+        container_class_idx = frozenset(
+            idx for idx, name in enumerate(class_names)
+            if any(item in name for item in CONTAINER_ITEMS)
+        )
+        
     except Exception as e:
         logger.error(f"Error loading models: {str(e)}")
         raise
 
+# Load models at import time so a preloading server (gunicorn --preload)
+# loads them once in the master and shares the weights with forked workers;
+# only the TFLite and ONNX backends are fork-safe (see gunicorn_conf.py)
+load_models()
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    _, dot, extension = filename.rpartition('.')
+    return bool(dot) and extension.lower() in ALLOWED_EXTENSIONS
+
+def map_upload(file):
+    """Memory-map an upload Werkzeug spooled to disk, or return None if it is in memory"""
+    # Uploads over 500KB roll over from a BytesIO to a temporary file
+    if not getattr(file.stream, '_rolled', False):
+        return None
+    
+    try:
+        return mmap.mmap(file.stream.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+
+# Per-thread reusable input buffers, one per input dtype
+_input_buffers = threading.local()
+
+def _input_buffer(dtype):
+    """Get this thread's (1, 224, 224, 3) input buffer for dtype"""
+    name = np.dtype(dtype).name
+    buf = getattr(_input_buffers, name, None)
+    if buf is None:
+        buf = np.empty((1, 224, 224, 3), dtype=dtype)
+        setattr(_input_buffers, name, buf)
+    return buf
 
 def preprocess_image(img):
-    """Preprocess image for MobileNetV2"""
+    """Preprocess image for MobileNetV2 (buffer is reused by the next call in this thread)"""
     try:
-        # Resize image to 224x224
-        img = img.resize((224, 224))
+        img_array = _input_buffer(np.float32)
+        img_array[0] = np.asarray(resize_image(img))
         
-        # Convert to RGB if not already
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        
-        # Convert to numpy array
-        img_array = image.img_to_array(img)
-        img_array = np.expand_dims(img_array, axis=0)
-        
-        # Preprocess for MobileNetV2
-        img_array = tf.keras.applications.mobilenet_v2.preprocess_input(img_array)
+        # Scale to [-1, 1] in place (same as mobilenet_v2.preprocess_input)
+        np.multiply(img_array, 1 / 127.5, out=img_array)
+        np.subtract(img_array, 1.0, out=img_array)
         
         return img_array
     except Exception as e:
         logger.error(f"Error preprocessing image: {str(e)}")
         raise
 
-def classify_image_content(img):
-    """Classify image content using MobileNetV2"""
+def preprocess_image_uint8(img):
+    """Preprocess image for the INT8 MobileNetV2 (uint8 NHWC, no rescaling)"""
     try:
-        # Preprocess image
-        processed_img = preprocess_image(img)
-        
-        # Get predictions
-        predictions = image_model.predict(processed_img)
-        
-        # Decode predictions
-        decoded_predictions = tf.keras.applications.mobilenet_v2.decode_predictions(
-            predictions, top=5
-        )[0]
-        
-        # Extract class names
-        class_names = [pred[1].lower() for pred in decoded_predictions]
-        
-        # Map to waste categories
-        recyclable_items = ['bottle', 'can', 'plastic', 'glass', 'paper', 'cardboard', 'container']
-        biodegradable_items = ['banana', 'apple', 'orange', 'fruit', 'food', 'vegetable']
-        hazardous_items = ['battery', 'electronic', 'chemical']
-        
-        # Determine category based on detected objects
-        for class_name in class_names:
-            if any(item in class_name for item in recyclable_items):
-                return 'recyclable', 0.85
-            elif any(item in class_name for item in biodegradable_items):
-                return 'biodegradable', 0.80
-            elif any(item in class_name for item in hazardous_items):
-                return 'hazardous', 0.75
-        
-        # Default classification based on general object detection
-        # If we detect containers, packaging, etc.
-        container_related = ['cup', 'bowl', 'plate', 'tray', 'box']
-        if any(item in ' '.join(class_names) for item in container_related):
-            return 'recyclable', 0.60
-        
-        # Default to recyclable for unknown items
-        return 'recyclable', 0.50
-        
+        img_array = _input_buffer(np.uint8)
+        img_array[0] = np.asarray(resize_image(img))
+        return img_array
     except Exception as e:
-        logger.error(f"Error classifying image: {str(e)}")
-        return 'recyclable', 0.30
+        logger.error(f"Error preprocessing image: {str(e)}")
+        raise
+
+class MicroBatcher:
+    """Coalesce concurrent predictions into batched model calls"""
+    
+    def __init__(self, max_batch=MAX_BATCH, max_wait_ms=MAX_WAIT_MS):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+    
+    def submit(self, input_data):
+        """Queue one preprocessed image and return a Future for its predictions"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((input_data, future))
+        return future
+    
+    def _ensure_worker(self):
+        """Start the batching thread (threads do not survive a fork)"""
+        if self._pid == os.getpid():
+            return
+        
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue()
+                threading.Thread(target=self._run, daemon=True).start()
+                self._pid = os.getpid()
+    
+    def _run(self):
+        """Drain up to max_batch requests or until max_wait, then predict once"""
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            
+            while len(items) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            try:
+                predictions = predict_batch(np.stack([input_data for input_data, _ in items]))
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+                continue
+            
+            for (_, future), prediction in zip(items, predictions):
+                future.set_result(prediction)
+
+batcher = MicroBatcher()
+
+def predict_batch(batch):
+    """Run MobileNetV2 on a stacked NHWC batch and return class probabilities"""
+    if onnx_model is not None:
+        return onnx_model.predict(batch)
+    
+    return image_model.predict(batch, verbose=0)
+
+def predict_image(img):
+    """Run MobileNetV2 on an image and return ImageNet class probabilities"""
+    if tflite_model is not None:
+        # The interpreter invokes once per image under its lock anyway, so
+        # the batcher would only add queueing latency
+        return tflite_model.predict(preprocess_image_uint8(img))
+    
+    # ONNX Runtime and Keras run a whole batch in one call
+    prediction = batcher.submit(preprocess_image(img)[0]).result(timeout=PREDICT_TIMEOUT)
+    return prediction[np.newaxis]
+
+def classify_image_content(img):
+    """Classify image content using MobileNetV2"""
+    # Get predictions
+    predictions = predict_image(img)[0]
+    
+    # Top-5 class indices, most likely first
+    top_indices = np.argpartition(-predictions, 5)[:5]
+    top_indices = top_indices[np.argsort(-predictions[top_indices])]
+    
+    # Determine category based on detected objects
+    for idx in top_indices:
+        waste = class_idx_to_waste[idx]
+        if waste is not None:
+            return waste
+    
+    # Default classification based on general object detection
+    # If we detect containers, packaging, etc.
+    if any(idx in container_class_idx for idx in top_indices):
+        return 'recyclable', 0.60
+    
+    # Default to recyclable for unknown items
+    return 'recyclable', 0.50
+
+# Category order, used to break score ties and to index the disposal tips
+_CATEGORY_RANK = {'recyclable': 0, 'biodegradable': 1, 'hazardous': 2}
 
 def classify_text_content(text):
     """Classify text description using keyword matching"""
     try:
         text_lower = text.lower()
         scores = {'recyclable': 0, 'biodegradable': 0, 'hazardous': 0}
-        
-        # Calculate scores for each category
-        for category, keywords in waste_keywords.items():
-            for keyword in keywords:
-                if keyword in text_lower:
-                    scores[category] += 1
-        
-        # Determine best category
-        if all(score == 0 for score in scores.values()):
+        best_category, max_score = 'recyclable', 0
+        
+        # Calculate scores for each category, tracking the best as we go
+        for category, weight in keyword_matcher.find(text_lower).values():
+            score = scores[category] + weight
+            scores[category] = score
+            
+            # Ties go to the category listed first
+            if score > max_score or (score == max_score and
+                                     _CATEGORY_RANK[category] < _CATEGORY_RANK[best_category]):
+                best_category, max_score = category, score
+        
+        if not max_score:
             # No keywords found, default to recyclable
             return 'recyclable', 0.30
         
-        best_category = max(scores, key=scores.get)
-        max_score = scores[best_category]
-        
         # Calculate confidence based on keyword matches
         confidence = min(0.95, 0.60 + (max_score * 0.10))
         
@@ -175,23 +337,22 @@ def classify_text_content(text):
         logger.error(f"Error classifying text: {str(e)}")
         return 'recyclable', 0.30
 
-def get_disposal_tip(category):
-    """Get disposal instructions for waste category"""
-    tips = {
-        'recyclable': "Clean the item and place it in the recycling bin. Remove any non-recyclable parts like caps or labels if possible.",
-        'biodegradable': "Compost this item in your garden compost bin or municipal composting facility. It will break down naturally and enrich the soil.",
-        'hazardous': "Take this item to a specialized hazardous waste collection center. Do not put it in regular trash as it can harm the environment."
-    }
-    return tips.get(category, "Check local waste management guidelines for proper disposal.")
+# Disposal instructions indexed by category rank, with the fallback last
+_DISPOSAL_TIPS = (
+    "Clean the item and place it in the recycling bin. Remove any non-recyclable parts like caps or labels if possible.",
+    "Compost this item in your garden compost bin or municipal composting facility. It will break down naturally and enrich the soil.",
+    "Take this item to a specialized hazardous waste collection center. Do not put it in regular trash as it can harm the environment.",
+    "Check local waste management guidelines for proper disposal."
+)
 
 @app.route('/', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return ojson({
         'status': 'healthy',
         'service': 'EcoSort AI Waste Classifier',
         'version': '1.0.0',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': health_timestamp()
     })
 
 @app.route('/classify-image', methods=['POST'])
@@ -200,45 +361,68 @@ def classify_image_endpoint():
     try:
         # Check if image file is in request
         if 'image' not in request.files and 'file' not in request.files:
-            return jsonify({'error': 'No image file provided'}), 400
+            return ojson({'error': 'No image file provided'}, 400)
         
         # Get the file (try both 'image' and 'file' keys for compatibility)
         file = request.files.get('image') or request.files.get('file')
         
         if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
+            return ojson({'error': 'No file selected'}, 400)
         
         if not allowed_file(file.filename):
-            return jsonify({'error': 'File type not allowed'}), 400
-        
-        # Check file size
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
-        
-        if file_size > MAX_FILE_SIZE:
-            return jsonify({'error': 'File too large'}), 400
-        
-        # Load and process image
-        img = Image.open(io.BytesIO(file.read()))
-        
-        # Classify image
-        label, confidence = classify_image_content(img)
+            return ojson({'error': 'File type not allowed'}, 400)
+        
+        # Reject non-image content before PIL parses it
+        if sniff_image_type(file.stream) is None:
+            return ojson({'error': 'Invalid image file'}, 400)
+        
+        # Hash and decode large uploads from the page cache instead of
+        # copying them through read() calls on the temporary file
+        mapped = map_upload(file)
+        try:
+            if mapped is not None:
+                source, cache_key = mapped, hash_bytes(mapped)
+            else:
+                source, cache_key = file.stream, hash_stream(file.stream)
+            cached = image_cache.get(cache_key)
+            
+            if cached is None:
+                # Decode straight from the upload; pixels are read when
+                # preprocess_image resizes it, after JPEG draft mode is applied
+                img = Image.open(source)
+                
+                # Classify image; a failed attempt (e.g. a batch timeout)
+                # gets the fallback answer but is not cached
+                try:
+                    label, confidence = classify_image_content(img)
+                except Exception as e:
+                    logger.error(f"Error classifying image: {str(e)}")
+                    label, confidence = 'recyclable', 0.30
+                else:
+                    image_cache.set(cache_key, (label, confidence))
+            else:
+                label, confidence = cached
+        finally:
+            if mapped is not None:
+                mapped.close()
         
         # Get disposal tip
-        tip = get_disposal_tip(label)
+        tip = _DISPOSAL_TIPS[_CATEGORY_RANK.get(label, 3)]
         
         logger.info(f"Image classified as: {label} (confidence: {confidence:.2f})")
         
-        return jsonify({
+        return ojson({
             'label': label,
             'confidence': confidence,
             'tip': tip
         })
         
+    except HTTPException:
+        # Let the error handlers respond (e.g. 413 from MAX_CONTENT_LENGTH)
+        raise
     except Exception as e:
         logger.error(f"Error in image classification: {str(e)}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojson({'error': 'Internal server error'}, 500)
 
 @app.route('/classify-text', methods=['POST'])
 def classify_text_endpoint():
@@ -247,22 +431,29 @@ def classify_text_endpoint():
         data = request.get_json()
         
         if not data or 'text' not in data:
-            return jsonify({'error': 'No text provided'}), 400
+            return ojson({'error': 'No text provided'}, 400)
         
         text = data['text'].strip()
         
         if not text:
-            return jsonify({'error': 'Empty text provided'}), 400
+            return ojson({'error': 'Empty text provided'}, 400)
         
         # Classify text
-        label, confidence = classify_text_content(text)
+        cache_key = hash_text(text)
+        cached = text_cache.get(cache_key)
+        
+        if cached is None:
+            label, confidence = classify_text_content(text)
+            text_cache.set(cache_key, (label, confidence))
+        else:
+            label, confidence = cached
         
         # Get disposal tip
-        tip = get_disposal_tip(label)
+        tip = _DISPOSAL_TIPS[_CATEGORY_RANK.get(label, 3)]
         
         logger.info(f"Text '{text}' classified as: {label} (confidence: {confidence:.2f})")
         
-        return jsonify({
+        return ojson({
             'label': label,
             'confidence': confidence,
             'tip': tip
@@ -270,35 +461,32 @@ def classify_text_endpoint():
         
     except Exception as e:
         logger.error(f"Error in text classification: {str(e)}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojson({'error': 'Internal server error'}, 500)
 
 @app.errorhandler(413)
 def too_large(e):
     """Handle file too large error"""
-    return jsonify({'error': 'File too large'}), 413
+    return ojson({'error': 'File too large'}, 413)
 
 @app.errorhandler(404)
 def not_found(e):
     """Handle not found error"""
-    return jsonify({'error': 'Endpoint not found'}), 404
+    return ojson({'error': 'Endpoint not found'}, 404)
 
 @app.errorhandler(500)
 def internal_error(e):
     """Handle internal server error"""
-    return jsonify({'error': 'Internal server error'}), 500
+    return ojson({'error': 'Internal server error'}, 500)
 
 if __name__ == '__main__':
     try:
         logger.info("Starting EcoSort backend server...")
         
-        # Load ML models
-        load_models()
-        
         # Start Flask app
         app.run(
             host='0.0.0.0',
             port=3000,
-            debug=True
+            debug=os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
         )
         
     except Exception as e:
@@ -5,31 +5,46 @@ AI-powered waste classification server for image and text inputs
 """
 
 import os
-import io
 import logging
 import random
-from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, request
 from flask_cors import CORS
 from PIL import Image
-from werkzeug.utils import secure_filename
+from werkzeug.exceptions import HTTPException
+
+from classification_core import (
+    KeywordMatcher, ResultCache, hash_stream, hash_text, health_timestamp,
+    load_tflite_classifier, ojson, sniff_image_type
+)
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)  # Enable CORS for React frontend
 
 # Configure logging
-logging.basicConfig(level=logging.INFO)
+logging.basicConfig(
+    level=logging.WARNING if os.getenv('FLASK_ENV') == 'production' else logging.INFO
+)
 logger = logging.getLogger(__name__)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+ALLOWED_EXTENSIONS = frozenset(('png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'))
+CACHE_SIZE = int(os.getenv('CLASSIFICATION_CACHE_SIZE', 4096))
+TFLITE_MODEL_PATH = os.getenv('TFLITE_MODEL_PATH', 'mbv2_int8.tflite')
+IMAGENET_LABELS_PATH = os.getenv('IMAGENET_LABELS_PATH', 'imagenet_labels.txt')
+
+# Oversized uploads are rejected by Werkzeug with a 413 before being read
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE
 
 # Ensure upload directory exists
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Classification results keyed by content hash
+image_cache = ResultCache(maxsize=CACHE_SIZE)
+text_cache = ResultCache(maxsize=CACHE_SIZE)
+
 # Waste classification keywords
 WASTE_KEYWORDS = {
     'recyclable': [
@@ -52,56 +67,76 @@ WASTE_KEYWORDS = {
     ]
 }
 
+# All keywords compiled into one matcher
+keyword_matcher = KeywordMatcher(WASTE_KEYWORDS)
+
+# INT8 MobileNetV2 (built with convert_model.py), None if not available
+image_classifier = load_tflite_classifier(TFLITE_MODEL_PATH, IMAGENET_LABELS_PATH)
+
 def allowed_file(filename):
     """Check if file extension is allowed"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+    _, dot, extension = filename.rpartition('.')
+    return bool(dot) and extension.lower() in ALLOWED_EXTENSIONS
+
+# Cumulative recyclable/biodegradable thresholds of the heuristic fallback
+# (0.6/0.3/0.1 weights, more likely to be recyclable)
+_HEURISTIC_THRESHOLDS = (0.6, 0.9)
 
 def classify_image_content(img):
-    """Classify image content using basic heuristics"""
-    try:
-        # Get image dimensions and format for basic analysis
-        width, height = img.size
-        format_type = img.format
-        
-        # Simple heuristic classification based on image properties
-        # This is a placeholder - in production, you'd use a trained model
-        
-        # Simulate classification based on filename or random for demo
-        categories = ['recyclable', 'biodegradable', 'hazardous']
-        weights = [0.6, 0.3, 0.1]  # More likely to be recyclable
-        
-        category = random.choices(categories, weights=weights)[0]
-        confidence = round(random.uniform(0.7, 0.95), 2)
-        
-        logger.info(f"Image ({width}x{height}, {format_type}) classified as: {category}")
-        
+    """Classify image content using the INT8 MobileNetV2, or basic heuristics without it"""
+    # Get image dimensions and format for basic analysis
+    width, height = img.size
+    format_type = img.format
+    
+    if image_classifier is not None:
+        # Map the top ImageNet labels to a category with the keyword pipeline
+        labels = image_classifier.top_labels(img)
+        category, confidence = classify_text_content(' '.join(labels).replace('_', ' '))
+        
+        logger.info(f"Image ({width}x{height}, {format_type}) {labels} classified as: {category}")
         return category, confidence
-        
-    except Exception as e:
-        logger.error(f"Error classifying image: {str(e)}")
-        return 'recyclable', 0.30
+    
+    # Simple heuristic classification based on image properties
+    # This is a placeholder - in production, you'd use a trained model
+    
+    # Simulate classification based on filename or random for demo
+    r = random.random()
+    if r < _HEURISTIC_THRESHOLDS[0]:
+        category = 'recyclable'
+    elif r < _HEURISTIC_THRESHOLDS[1]:
+        category = 'biodegradable'
+    else:
+        category = 'hazardous'
+    confidence = round(0.7 + random.random() * 0.25, 2)
+    
+    logger.info(f"Image ({width}x{height}, {format_type}) classified as: {category}")
+    
+    return category, confidence
+
+# Category order, used to break score ties and to index the disposal tips
+_CATEGORY_RANK = {'recyclable': 0, 'biodegradable': 1, 'hazardous': 2}
 
 def classify_text_content(text):
     """Classify text description using keyword matching"""
     try:
         text_lower = text.lower()
         scores = {'recyclable': 0, 'biodegradable': 0, 'hazardous': 0}
-        
-        # Calculate scores for each category
-        for category, keywords in WASTE_KEYWORDS.items():
-            for keyword in keywords:
-                if keyword in text_lower:
-                    scores[category] += 1
-        
-        # Determine best category
-        if all(score == 0 for score in scores.values()):
+        best_category, max_score = 'recyclable', 0
+        
+        # Calculate scores for each category, tracking the best as we go
+        for category, weight in keyword_matcher.find(text_lower).values():
+            score = scores[category] + weight
+            scores[category] = score
+            
+            # Ties go to the category listed first
+            if score > max_score or (score == max_score and
+                                     _CATEGORY_RANK[category] < _CATEGORY_RANK[best_category]):
+                best_category, max_score = category, score
+        
+        if not max_score:
             # No keywords found, default to recyclable
             return 'recyclable', 0.30
         
-        best_category = max(scores, key=scores.get)
-        max_score = scores[best_category]
-        
         # Calculate confidence based on keyword matches
         confidence = min(0.95, 0.60 + (max_score * 0.10))
         
@@ -111,23 +146,22 @@ def classify_text_content(text):
         logger.error(f"Error classifying text: {str(e)}")
         return 'recyclable', 0.30
 
-def get_disposal_tip(category):
-    """Get disposal instructions for waste category"""
-    tips = {
-        'recyclable': "Clean the item and place it in the recycling bin. Remove any non-recyclable parts like caps or labels if possible.",
-        'biodegradable': "Compost this item in your garden compost bin or municipal composting facility. It will break down naturally and enrich the soil.",
-        'hazardous': "Take this item to a specialized hazardous waste collection center. Do not put it in regular trash as it can harm the environment."
-    }
-    return tips.get(category, "Check local waste management guidelines for proper disposal.")
+# Disposal instructions indexed by category rank, with the fallback last
+_DISPOSAL_TIPS = (
+    "Clean the item and place it in the recycling bin. Remove any non-recyclable parts like caps or labels if possible.",
+    "Compost this item in your garden compost bin or municipal composting facility. It will break down naturally and enrich the soil.",
+    "Take this item to a specialized hazardous waste collection center. Do not put it in regular trash as it can harm the environment.",
+    "Check local waste management guidelines for proper disposal."
+)
 
 @app.route('/', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return ojson({
         'status': 'healthy',
         'service': 'EcoSort AI Waste Classifier',
         'version': '1.0.0',
-        'timestamp': datetime.now().isoformat()
+        'timestamp': health_timestamp()
     })
 
 @app.route('/classify-image', methods=['POST'])
@@ -136,45 +170,58 @@ def classify_image_endpoint():
     try:
         # Check if image file is in request
         if 'image' not in request.files and 'file' not in request.files:
-            return jsonify({'error': 'No image file provided'}), 400
+            return ojson({'error': 'No image file provided'}, 400)
         
         # Get the file (try both 'image' and 'file' keys for compatibility)
         file = request.files.get('image') or request.files.get('file')
         
         if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
+            return ojson({'error': 'No file selected'}, 400)
         
         if not allowed_file(file.filename):
-            return jsonify({'error': 'File type not allowed'}), 400
-        
-        # Check file size
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
-        
-        if file_size > MAX_FILE_SIZE:
-            return jsonify({'error': 'File too large'}), 400
-        
-        # Load and process image
-        img = Image.open(io.BytesIO(file.read()))
-        
-        # Classify image
-        label, confidence = classify_image_content(img)
+            return ojson({'error': 'File type not allowed'}, 400)
+        
+        # Reject non-image content before PIL parses it
+        if sniff_image_type(file.stream) is None:
+            return ojson({'error': 'Invalid image file'}, 400)
+        
+        cache_key = hash_stream(file.stream)
+        cached = image_cache.get(cache_key)
+        
+        if cached is None:
+            # Decoded lazily; the heuristic fallback only parses the header
+            img = Image.open(file.stream)
+            
+            # Classify image; only model answers are cached, not a failed
+            # attempt's fallback or the random heuristic's placeholder
+            try:
+                label, confidence = classify_image_content(img)
+            except Exception as e:
+                logger.error(f"Error classifying image: {str(e)}")
+                label, confidence = 'recyclable', 0.30
+            else:
+                if image_classifier is not None:
+                    image_cache.set(cache_key, (label, confidence))
+        else:
+            label, confidence = cached
         
         # Get disposal tip
-        tip = get_disposal_tip(label)
+        tip = _DISPOSAL_TIPS[_CATEGORY_RANK.get(label, 3)]
         
         logger.info(f"Image classified as: {label} (confidence: {confidence:.2f})")
         
-        return jsonify({
+        return ojson({
             'label': label,
             'confidence': confidence,
             'tip': tip
         })
         
+    except HTTPException:
+        # Let the error handlers respond (e.g. 413 from MAX_CONTENT_LENGTH)
+        raise
     except Exception as e:
         logger.error(f"Error in image classification: {str(e)}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojson({'error': 'Internal server error'}, 500)
 
 @app.route('/classify-text', methods=['POST'])
 def classify_text_endpoint():
@@ -183,22 +230,29 @@ def classify_text_endpoint():
         data = request.get_json()
         
         if not data or 'text' not in data:
-            return jsonify({'error': 'No text provided'}), 400
+            return ojson({'error': 'No text provided'}, 400)
         
         text = data['text'].strip()
         
         if not text:
-            return jsonify({'error': 'Empty text provided'}), 400
+            return ojson({'error': 'Empty text provided'}, 400)
         
         # Classify text
-        label, confidence = classify_text_content(text)
+        cache_key = hash_text(text)
+        cached = text_cache.get(cache_key)
+        
+        if cached is None:
+            label, confidence = classify_text_content(text)
+            text_cache.set(cache_key, (label, confidence))
+        else:
+            label, confidence = cached
         
         # Get disposal tip
-        tip = get_disposal_tip(label)
+        tip = _DISPOSAL_TIPS[_CATEGORY_RANK.get(label, 3)]
         
         logger.info(f"Text '{text}' classified as: {label} (confidence: {confidence:.2f})")
         
-        return jsonify({
+        return ojson({
             'label': label,
             'confidence': confidence,
             'tip': tip
@@ -206,22 +260,22 @@ def classify_text_endpoint():
         
     except Exception as e:
         logger.error(f"Error in text classification: {str(e)}")
-        return jsonify({'error': 'Internal server error'}), 500
+        return ojson({'error': 'Internal server error'}, 500)
 
 @app.errorhandler(413)
 def too_large(e):
     """Handle file too large error"""
-    return jsonify({'error': 'File too large'}), 413
+    return ojson({'error': 'File too large'}, 413)
 
 @app.errorhandler(404)
 def not_found(e):
     """Handle not found error"""
-    return jsonify({'error': 'Endpoint not found'}), 404
+    return ojson({'error': 'Endpoint not found'}, 404)
 
 @app.errorhandler(500)
 def internal_error(e):
     """Handle internal server error"""
-    return jsonify({'error': 'Internal server error'}), 500
+    return ojson({'error': 'Internal server error'}, 500)
 
 if __name__ == '__main__':
     try:
@@ -231,7 +285,7 @@ if __name__ == '__main__':
         app.run(
             host='0.0.0.0',
             port=5000,
-            debug=True
+            debug=os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
         )
         
     except Exception as e:
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Shared classification utilities for EcoSort Backend API
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import orjson
+from flask import Response
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+def ojson(data: Dict[str, Any], status: int = 200) -> Response:
+    """Serialize data with orjson into a JSON response"""
+    return Response(orjson.dumps(data), status=status, mimetype='application/json')
+
+
+# Health check timestamp, formatted at most once per second
+_timestamp_second = None
+_timestamp = ''
+
+
+def health_timestamp() -> str:
+    """Get the current ISO timestamp, cached at one-second granularity"""
+    global _timestamp_second, _timestamp
+
+    # Keyed on the wall clock being formatted, so the stamp changes exactly
+    # when its seconds digit does and follows clock steps
+    now = time.time()
+    now_second = int(now)
+    if now_second != _timestamp_second:
+        # Benign race: concurrent threads may each format it once
+        _timestamp = datetime.fromtimestamp(now).isoformat(timespec='seconds')
+        _timestamp_second = now_second
+    return _timestamp
+
+
+def hash_bytes(data: bytes) -> str:
+    """Content hash used as the cache key for uploaded files"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def hash_stream(stream, chunk_size: int = 64 * 1024) -> str:
+    """Content hash of a file-like object, read in chunks and rewound"""
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in iter(lambda: stream.read(chunk_size), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+
+def hash_text(text: str) -> str:
+    """Content hash used as the cache key for text descriptions"""
+    return hash_bytes(text.lower().encode())
+
+
+# Leading magic bytes of the accepted image formats
+_IMAGE_SIGNATURES = (
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+)
+
+
+def sniff_image_type(stream) -> Optional[str]:
+    """Identify an upload by its magic bytes, or return None if it is not an image
+
+    Only the first 12 bytes are read, so renamed non-image files are
+    rejected without PIL parsing the whole upload.
+    """
+    head = stream.read(12)
+    stream.seek(0)
+
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+
+    for signature, image_type in _IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_type
+    return None
+
+
+# Lowercase words of a text
+_WORD_RE = re.compile(r'[a-z]+')
+
+
+def _word_forms(keyword: str) -> List[str]:
+    """Plural forms of a keyword that should match it (bottles, boxes, batteries)"""
+    forms = [keyword + 's', keyword + 'es']
+    if keyword.endswith('y'):
+        forms.append(keyword[:-1] + 'ies')
+    return forms
+
+
+class KeywordMatcher:
+    """Find every waste keyword in a text with one pass over its words"""
+
+    def __init__(self, keywords: Dict[str, List[str]],
+                 weight: Optional[Callable[[str], float]] = None):
+        # Each keyword's (category, weight) is computed once here rather
+        # than per match
+        self.entries = {
+            keyword: (category, weight(keyword) if weight else 1)
+            for category, category_keywords in keywords.items()
+            for keyword in category_keywords
+        }
+
+        # Whole-word lookup, so 'can' no longer matches inside 'canister'
+        # or 'oil' inside 'toilet'; exact keywords win over plural forms
+        words = {}
+        for keyword in self.entries:
+            if not _WORD_RE.fullmatch(keyword):
+                raise ValueError(f"Keyword {keyword!r} is not a single lowercase word")
+            words[keyword] = keyword
+        for keyword in list(words):
+            for form in _word_forms(keyword):
+                words.setdefault(form, keyword)
+        self._words = words
+
+    def find(self, text: str) -> Dict[str, Tuple[str, float]]:
+        """Return {keyword: (category, weight)} for every keyword in lowercase text"""
+        words = self._words
+        entries = self.entries
+
+        found = {}
+        for word in set(_WORD_RE.findall(text)):
+            keyword = words.get(word)
+            if keyword is not None:
+                found[keyword] = entries[keyword]
+
+        return found
+
+
+class ResultCache:
+    """Thread-safe in-process LRU cache of classification results"""
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached result for key, or None on a miss"""
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        """Store a result, evicting the least recently used entry if full"""
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """Drop every cached result and reset the counters"""
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Get cache hit/miss counters"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data)
+        }
+
+
+def resize_image(img):
+    """Decode and resize an image to the 224x224 RGB MobileNetV2 input"""
+    # Let libjpeg decode large JPEGs at a reduced scale (1/2, 1/4, 1/8)
+    # instead of decoding the full resolution and resizing it down
+    img.draft('RGB', (224, 224))
+
+    # Resize image to 224x224
+    img = img.resize((224, 224), Image.BILINEAR)
+
+    # Convert to RGB if not already
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+
+    return img
+
+
+class TFLiteImageClassifier:
+    """INT8 MobileNetV2 served by a persistent TFLite interpreter"""
+
+    def __init__(self, interpreter_factory, labels: Optional[List[str]] = None):
+        self.labels = labels
+        self._interpreter_factory = interpreter_factory
+        self._create_interpreter()
+
+        # Interpreter thread pools do not survive fork; the model file itself
+        # is mmapped, so re-creating it keeps the weights in shared page cache
+        os.register_at_fork(after_in_child=self._create_interpreter)
+
+    def _create_interpreter(self) -> None:
+        """Create the interpreter and cache its tensor details"""
+        self._lock = threading.Lock()
+        self._interpreter = self._interpreter_factory()
+        self._interpreter.allocate_tensors()
+        self.input_details = self._interpreter.get_input_details()[0]
+        self.output_details = self._interpreter.get_output_details()[0]
+
+    def predict(self, batch):
+        """Return ImageNet class probabilities for a uint8 NHWC batch"""
+        # The interpreter keeps fixed batch-1 tensors (resizing them would
+        # re-prepare the delegate), so invoke once per image
+        predictions = []
+        with self._lock:
+            for input_data in batch:
+                self._interpreter.set_tensor(self.input_details['index'], input_data[np.newaxis])
+                self._interpreter.invoke()
+                predictions.append(self._interpreter.get_tensor(self.output_details['index'])[0])
+        predictions = np.stack(predictions)
+
+        # Dequantize uint8 scores back to probabilities
+        scale, zero_point = self.output_details['quantization']
+        if scale:
+            predictions = (predictions.astype(np.float32) - zero_point) * scale
+
+        # Drop the background class of 1001-class exports
+        if predictions.shape[-1] == 1001:
+            predictions = predictions[:, 1:]
+
+        return predictions
+
+    def top_labels(self, img, top: int = 5) -> List[str]:
+        """Classify a PIL image and return its top ImageNet label names"""
+        input_data = np.asarray(resize_image(img), dtype=np.uint8)[np.newaxis]
+        probabilities = self.predict(input_data)[0]
+        return [self.labels[i] for i in np.argsort(probabilities)[::-1][:top]]
+
+
+def load_tflite_classifier(model_path: str, labels_path: str = None,
+                           num_threads: int = None,
+                           delegate: str = None) -> Optional[TFLiteImageClassifier]:
+    """Load the INT8 MobileNetV2, or return None if it is not available"""
+    if not os.path.exists(model_path):
+        logger.warning(f"{model_path} not found (run convert_model.py to build it)")
+        return None
+
+    try:
+        from tflite_runtime.interpreter import Interpreter, load_delegate
+    except ImportError:
+        try:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+            load_delegate = tf.lite.experimental.load_delegate
+        except ImportError:
+            logger.warning("Neither tflite-runtime nor tensorflow is installed")
+            return None
+
+    # top_labels needs the class names, so a missing label map disables the model
+    labels = None
+    if labels_path:
+        try:
+            with open(labels_path) as f:
+                labels = [line.strip() for line in f]
+        except OSError as e:
+            logger.error(f"Cannot load ImageNet labels from {labels_path}: {e}")
+            return None
+
+    def interpreter_factory():
+        # e.g. delegate='libedgetpu.so.1' for a Coral Edge TPU
+        delegates = [load_delegate(delegate)] if delegate else None
+        return Interpreter(model_path=model_path, num_threads=num_threads or os.cpu_count(),
+                           experimental_delegates=delegates)
+
+    classifier = TFLiteImageClassifier(interpreter_factory, labels)
+    logger.info(f"INT8 MobileNetV2 loaded from {model_path}")
+    return classifier
+
+
+class OnnxImageClassifier:
+    """MobileNetV2 served by an ONNX Runtime session with fused CPU kernels"""
+
+    def __init__(self, session_factory):
+        self._session_factory = session_factory
+        self._create_session()
+
+        # Session thread pools do not survive fork either
+        os.register_at_fork(after_in_child=self._create_session)
+
+    def _create_session(self) -> None:
+        """Create the inference session and cache its input name"""
+        self._session = self._session_factory()
+        self.input_name = self._session.get_inputs()[0].name
+
+    def predict(self, batch):
+        """Return ImageNet class probabilities for a preprocessed float32 NHWC batch"""
+        # InferenceSession.run is thread-safe and takes any batch size
+        return self._session.run(None, {self.input_name: batch})[0]
+
+
+def load_onnx_classifier(model_path: str, num_threads: int = None) -> Optional[OnnxImageClassifier]:
+    """Load the ONNX MobileNetV2, or return None if it is not available"""
+    if not os.path.exists(model_path):
+        logger.warning(f"{model_path} not found (run convert_model.py --onnx-output to build it)")
+        return None
+
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        logger.warning("onnxruntime is not installed")
+        return None
+
+    def session_factory():
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = num_threads or os.cpu_count()
+        # Constant folding plus Conv+BN+ReLU and other layout fusions
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        return ort.InferenceSession(model_path, sess_options=options,
+                                    providers=['CPUExecutionProvider'])
+
+    classifier = OnnxImageClassifier(session_factory)
+    logger.info(f"ONNX MobileNetV2 loaded from {model_path}")
+    return classifier
@@ -5,57 +5,81 @@ Production configuration and utilities for EcoSort Backend API
 
 import os
 import logging
-from typing import Dict, Any
-from dotenv import load_dotenv
+from functools import lru_cache
+from typing import Dict, Any, Set
+
+# .env files already loaded into os.environ by this process
+_DOTENV_LOADED: Set[str] = set()
+
+def _load_dotenv(env_file: str = None) -> None:
+    """Load a .env file into os.environ once per process"""
+    # Containers inject the environment directly, DOTENV_SKIP=1 skips parsing .env
+    if os.getenv('DOTENV_SKIP') == '1':
+        return
+    
+    path = env_file or '.env'
+    if path in _DOTENV_LOADED:
+        return
+    _DOTENV_LOADED.add(path)
+    
+    # Only imported when a .env file is actually parsed
+    from dotenv import load_dotenv
+    
+    if env_file:
+        load_dotenv(env_file)
+    else:
+        load_dotenv()
+
 
 class Config:
     """Base configuration class"""
     
     def __init__(self, env_file: str = None):
-        if env_file:
-            load_dotenv(env_file)
-        else:
-            load_dotenv()
-    
-    # Flask Configuration
-    FLASK_ENV = os.getenv('FLASK_ENV', 'development')
-    DEBUG = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
-    SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
-    
-    # Server Configuration
-    HOST = os.getenv('HOST', '0.0.0.0')
-    PORT = int(os.getenv('PORT', 5000))
-    
-    # API Configuration
-    API_KEY = os.getenv('API_KEY')
-    RATE_LIMIT_PER_MINUTE = int(os.getenv('RATE_LIMIT_PER_MINUTE', 60))
-    MAX_FILE_SIZE_MB = int(os.getenv('MAX_FILE_SIZE_MB', 16))
-    
-    # CORS Configuration
-    CORS_ORIGINS = os.getenv('CORS_ORIGINS', 'http://localhost:3000').split(',')
-    
-    # Logging Configuration
-    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
-    LOG_FILE = os.getenv('LOG_FILE', 'logs/app.log')
-    
-    # Database Configuration
-    DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///ecosort.db')
-    
-    # ML Model Configuration
-    USE_TENSORFLOW_MODEL = os.getenv('USE_TENSORFLOW_MODEL', 'False').lower() == 'true'
-    MODEL_PATH = os.getenv('MODEL_PATH', 'models/')
-    
-    # Monitoring Configuration
-    ENABLE_METRICS = os.getenv('ENABLE_METRICS', 'False').lower() == 'true'
-    METRICS_PORT = int(os.getenv('METRICS_PORT', 9090))
-    
-    # Security Configuration
-    ALLOWED_EXTENSIONS = set(os.getenv('ALLOWED_EXTENSIONS', 'png,jpg,jpeg,gif,bmp,webp').split(','))
-    UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
-    
-    @property
-    def MAX_FILE_SIZE_BYTES(self) -> int:
-        return self.MAX_FILE_SIZE_MB * 1024 * 1024
+        # Read the environment after the .env file is loaded, not at import
+        _load_dotenv(env_file)
+        
+        # Flask Configuration
+        self.FLASK_ENV = os.getenv('FLASK_ENV', 'development')
+        self.DEBUG = os.getenv('FLASK_DEBUG', 'True').lower() == 'true'
+        self.SECRET_KEY = os.getenv('SECRET_KEY', 'dev-secret-key-change-in-production')
+        
+        # Server Configuration
+        self.HOST = os.getenv('HOST', '0.0.0.0')
+        self.PORT = int(os.getenv('PORT', 5000))
+        
+        # API Configuration
+        self.API_KEY = os.getenv('API_KEY')
+        self.RATE_LIMIT_PER_MINUTE = int(os.getenv('RATE_LIMIT_PER_MINUTE', 60))
+        self.MAX_FILE_SIZE_MB = int(os.getenv('MAX_FILE_SIZE_MB', 16))
+        self.MAX_FILE_SIZE_BYTES = self.MAX_FILE_SIZE_MB * 1024 * 1024
+        
+        # CORS Configuration
+        self.CORS_ORIGINS = os.getenv('CORS_ORIGINS', 'http://localhost:3000').split(',')
+        
+        # Logging Configuration
+        self.LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+        self.LOG_FILE = os.getenv('LOG_FILE', 'logs/app.log')
+        
+        # Database Configuration
+        self.DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///ecosort.db')
+        
+        # ML Model Configuration
+        self.USE_TENSORFLOW_MODEL = os.getenv('USE_TENSORFLOW_MODEL', 'False').lower() == 'true'
+        self.MODEL_PATH = os.getenv('MODEL_PATH', 'models/')
+        self.TFLITE_DELEGATE = os.getenv('TFLITE_DELEGATE')  # e.g. libedgetpu.so.1 for Coral
+        
+        # Cache Configuration
+        self.CLASSIFICATION_CACHE_SIZE = int(os.getenv('CLASSIFICATION_CACHE_SIZE', 4096))
+        
+        # Monitoring Configuration
+        self.ENABLE_METRICS = os.getenv('ENABLE_METRICS', 'False').lower() == 'true'
+        self.METRICS_PORT = int(os.getenv('METRICS_PORT', 9090))
+        
+        # Security Configuration
+        self.ALLOWED_EXTENSIONS = frozenset(
+            os.getenv('ALLOWED_EXTENSIONS', 'png,jpg,jpeg,gif,bmp,webp').split(',')
+        )
+        self.UPLOAD_FOLDER = os.getenv('UPLOAD_FOLDER', 'uploads')
     
     def setup_logging(self) -> None:
         """Setup application logging"""
@@ -107,35 +131,47 @@ class Config:
 
 class DevelopmentConfig(Config):
     """Development configuration"""
-    DEBUG = True
-    FLASK_ENV = 'development'
+    
+    def __init__(self):
+        super().__init__()
+        self.DEBUG = True
+        self.FLASK_ENV = 'development'
 
 
 class ProductionConfig(Config):
     """Production configuration"""
-    DEBUG = False
-    FLASK_ENV = 'production'
     
     def __init__(self):
         super().__init__('.env.production')
+        self.DEBUG = False
+        self.FLASK_ENV = 'production'
 
 
 class TestingConfig(Config):
     """Testing configuration"""
-    DEBUG = True
-    FLASK_ENV = 'testing'
-    UPLOAD_FOLDER = 'test_uploads'
+    
+    def __init__(self):
+        super().__init__()
+        self.DEBUG = True
+        self.FLASK_ENV = 'testing'
+        self.UPLOAD_FOLDER = 'test_uploads'
 
 
-def get_config(env: str = None) -> Config:
-    """Get configuration based on environment"""
-    if env is None:
-        env = os.getenv('FLASK_ENV', 'development')
-    
+@lru_cache(maxsize=None)
+def _build_config(env: str) -> Config:
+    """Build the configuration for an environment once (loads its .env file)"""
     configs = {
         'development': DevelopmentConfig,
         'production': ProductionConfig,
         'testing': TestingConfig
     }
     
-    return configs.get(env, DevelopmentConfig)()
\ No newline at end of file
+    return configs.get(env, DevelopmentConfig)()
+
+
+def get_config(env: str = None) -> Config:
+    """Get configuration based on environment"""
+    if env is None:
+        env = os.getenv('FLASK_ENV', 'development')
+    
+    return _build_config(env)
\ No newline at end of file
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Convert MobileNetV2 to an INT8-quantized TFLite model for EcoSort Backend API
+
+Usage:
+    python convert_model.py --calibration-dir path/to/images --output mbv2_int8.tflite
+    python convert_model.py --onnx-output mbv2_int8.onnx
+"""
+
+import os
+import json
+import argparse
+import logging
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+from tensorflow.keras.applications import MobileNetV2
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.webp')
+CLASS_INDEX_URL = ('https://storage.googleapis.com/download.tensorflow.org/'
+                   'data/imagenet_class_index.json')
+
+
+def build_model():
+    """Build MobileNetV2 taking raw 0-255 pixels as input"""
+    inputs = tf.keras.Input(shape=(224, 224, 3))
+    # Fold preprocess_input (x / 127.5 - 1) into the graph so the
+    # quantized model accepts uint8 pixels directly
+    x = tf.keras.layers.Rescaling(1 / 127.5, offset=-1)(inputs)
+    outputs = MobileNetV2(weights='imagenet', include_top=True, input_shape=(224, 224, 3))(x)
+    return tf.keras.Model(inputs, outputs)
+
+
+def representative_dataset(calibration_dir, num_samples):
+    """Yield calibration samples for INT8 quantization"""
+    paths = []
+    if calibration_dir:
+        paths = [
+            os.path.join(calibration_dir, name)
+            for name in sorted(os.listdir(calibration_dir))
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        ][:num_samples]
+
+    if not paths:
+        logger.warning("No calibration images found, using random samples "
+                       "(accuracy will be lower than with real waste images)")
+        for _ in range(num_samples):
+            yield [np.random.uniform(0, 255, (1, 224, 224, 3)).astype(np.float32)]
+        return
+
+    for path in paths:
+        img = Image.open(path).convert('RGB').resize((224, 224), Image.BILINEAR)
+        yield [np.asarray(img, dtype=np.float32)[np.newaxis]]
+
+
+def convert(calibration_dir, output, num_samples=100):
+    """Convert MobileNetV2 to a full-integer TFLite model"""
+    converter = tf.lite.TFLiteConverter.from_keras_model(build_model())
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = lambda: representative_dataset(calibration_dir, num_samples)
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    converter.inference_input_type = tf.uint8
+    converter.inference_output_type = tf.uint8
+
+    tflite_model = converter.convert()
+    with open(output, 'wb') as f:
+        f.write(tflite_model)
+
+    logger.info(f"INT8 model written to {output} ({len(tflite_model) / 1024 / 1024:.1f}MB)")
+
+
+def convert_onnx(output, opset=17):
+    """Export MobileNetV2 to ONNX with INT8 weights for ONNX Runtime"""
+    # Only needed for the ONNX backend
+    import tf2onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    # Same float32 [-1, 1] input as the Keras model, so app.py reuses preprocess_image
+    model = MobileNetV2(weights='imagenet', include_top=True, input_shape=(224, 224, 3))
+    input_signature = [tf.TensorSpec((None, 224, 224, 3), tf.float32, name='input')]
+
+    fp32_output = os.path.splitext(output)[0] + '_fp32.onnx'
+    tf2onnx.convert.from_keras(model, input_signature=input_signature, opset=opset,
+                               output_path=fp32_output)
+    quantize_dynamic(fp32_output, output, weight_type=QuantType.QInt8)
+    os.remove(fp32_output)
+
+    size_mb = os.path.getsize(output) / 1024 / 1024
+    logger.info(f"INT8 ONNX model written to {output} ({size_mb:.1f}MB)")
+
+
+def write_labels(output):
+    """Write the ImageNet class names, one per line in class index order"""
+    class_index_path = tf.keras.utils.get_file(
+        'imagenet_class_index.json', CLASS_INDEX_URL, cache_subdir='models'
+    )
+    with open(class_index_path) as f:
+        class_index = json.load(f)
+
+    with open(output, 'w') as f:
+        for i in range(len(class_index)):
+            f.write(class_index[str(i)][1] + '\n')
+
+    logger.info(f"ImageNet labels written to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert MobileNetV2 to INT8 TFLite')
+    parser.add_argument('--calibration-dir', help='Directory of sample waste images')
+    parser.add_argument('--num-samples', type=int, default=100,
+                        help='Number of calibration samples (default: 100)')
+    parser.add_argument('--output', default='mbv2_int8.tflite',
+                        help='Output model path (default: mbv2_int8.tflite)')
+    parser.add_argument('--labels-output', default='imagenet_labels.txt',
+                        help='Output label map path (default: imagenet_labels.txt)')
+    parser.add_argument('--onnx-output',
+                        help='Build an INT8 ONNX model for ONNX Runtime instead '
+                             '(e.g. mbv2_int8.onnx)')
+    args = parser.parse_args()
+
+    if args.onnx_output:
+        convert_onnx(args.onnx_output)
+        return
+
+    convert(args.calibration_dir, args.output, args.num_samples)
+    write_labels(args.labels_output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+"""
+Gunicorn configuration for EcoSort Backend API
+
+Usage:
+    gunicorn -c gunicorn_conf.py app:app
+    gunicorn -c gunicorn_conf.py app_production:app
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Load the app (and its ML models) once in the master before forking, so
+# workers share the model weights copy-on-write instead of reloading them.
+# The TFLite and ONNX runtimes are re-created in each worker after the fork,
+# but TensorFlow's thread pools are not fork-safe: when app.py falls back to
+# the FP32 Keras model, set GUNICORN_PRELOAD=false so each worker loads it
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Threaded workers keep serving other connections while one request is
+# blocked reading an upload or waiting on model inference
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+timeout = 120
+keepalive = 2
@@ -5,83 +5,268 @@ Monitoring and metrics utilities for EcoSort Backend API
 
 import time
 import logging
-from collections import defaultdict, Counter
+import threading
+from array import array
+from collections import defaultdict, deque, Counter
+from dataclasses import dataclass, field
 from datetime import datetime, timedelta
-from functools import wraps
-from flask import request, g
+from functools import lru_cache, wraps
+from flask import request
 import psutil
 import os
 
 logger = logging.getLogger(__name__)
 
+# System metrics are re-read at most this often (seconds)
+SYSTEM_METRICS_TTL = 2.0
+
+# Metrics summaries are rebuilt at most this often (seconds)
+SUMMARY_TTL = 1.0
+
+# Resident set size in pages is the second field of /proc/self/statm
+PROC_STATM = '/proc/self/statm'
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+# Requests slower than this are logged (nanoseconds)
+SLOW_REQUEST_NS = 2_000_000_000
+
+# Response times kept per endpoint for recent-latency inspection
+RECENT_RESPONSE_TIMES = 1024
+
+# Prime the system-wide CPU counters so non-blocking reads have a baseline
+psutil.cpu_percent(interval=None)
+
+# cgroup v2 memory files, present inside containers
+CGROUP_MEMORY_MAX = '/sys/fs/cgroup/memory.max'
+CGROUP_MEMORY_CURRENT = '/sys/fs/cgroup/memory.current'
+
+
+@lru_cache(maxsize=1)
+def _memory_limit():
+    """Get the container memory limit in bytes (read once), or None if unlimited"""
+    try:
+        with open(CGROUP_MEMORY_MAX) as f:
+            value = f.read().strip()
+    except OSError:
+        return None
+    
+    return None if value == 'max' else int(value)
+
+
+def memory_usage() -> dict:
+    """Get used percent, available and total memory, against the container limit if set"""
+    limit = _memory_limit()
+    if limit:
+        try:
+            with open(CGROUP_MEMORY_CURRENT) as f:
+                used = int(f.read())
+            return {
+                'percent': round(used / limit * 100, 1),
+                'available': max(limit - used, 0),
+                'total': limit
+            }
+        except (OSError, ValueError):
+            pass
+    
+    memory = psutil.virtual_memory()
+    return {'percent': memory.percent, 'available': memory.available, 'total': memory.total}
+
+
+def _join_keys(counts) -> dict:
+    """Turn tuple counter keys into the 'a:b' strings used in the summary"""
+    return {f"{first}:{second}": count for (first, second), count in counts.items()}
+
+
+class PackedCounter:
+    """Counters packed into one unsigned 64-bit array, indexed by key"""
+    
+    __slots__ = ('_index', '_counts', '_lock')
+    
+    def __init__(self, capacity: int = 16):
+        self._index = {}
+        self._counts = array('Q', bytes(8 * capacity))
+        self._lock = threading.Lock()
+    
+    def increment(self, key) -> None:
+        """Add one to the counter for key"""
+        idx = self._index.get(key)
+        if idx is None:
+            idx = self._add_key(key)
+        self._counts[idx] += 1
+    
+    def _add_key(self, key) -> int:
+        """Assign the next slot to a new key, doubling the array when full"""
+        with self._lock:
+            idx = self._index.get(key)
+            if idx is None:
+                idx = len(self._index)
+                if idx == len(self._counts):
+                    self._counts.extend(array('Q', bytes(8 * len(self._counts))))
+                self._index[key] = idx
+            return idx
+    
+    def to_dict(self) -> dict:
+        """Get the counters as {key: count}"""
+        # Copy the index first; _add_key may insert from another thread
+        # while this iterates
+        counts = self._counts
+        return {key: counts[idx] for key, idx in dict(self._index).items()}
+
+
+@dataclass(slots=True)
+class EndpointStats:
+    """Running response time aggregates for one endpoint"""
+    count: int = 0
+    total: float = 0.0
+    min: float = float('inf')
+    max: float = 0.0
+    recent: deque = field(default_factory=lambda: deque(maxlen=RECENT_RESPONSE_TIMES))
+    
+    def add(self, response_time: float) -> None:
+        """Record one response time"""
+        self.count += 1
+        self.total += response_time
+        if response_time < self.min:
+            self.min = response_time
+        if response_time > self.max:
+            self.max = response_time
+        self.recent.append(response_time)
+
 
 class MetricsCollector:
     """Collect and store application metrics"""
     
+    __slots__ = (
+        'request_count', 'response_times', 'error_count', 'classification_stats',
+        'start_time', 'total_requests', 'total_errors', '_summary', '_summary_time',
+        '_process', '_statm_fd', '_statm_buf', '_system_metrics', '_system_metrics_time'
+    )
+    
     def __init__(self):
-        self.request_count = Counter()
-        self.response_times = defaultdict(list)
-        self.error_count = Counter()
+        self.request_count = PackedCounter()
+        self.response_times = defaultdict(EndpointStats)
+        self.error_count = PackedCounter()
         self.classification_stats = Counter()
         self.start_time = time.time()
+        self.total_requests = 0
+        self.total_errors = 0
+        self._summary = None
+        self._summary_time = 0.0
+        self._process = None
+        self._statm_fd = None
+        self._statm_buf = bytearray(128)
+        self._system_metrics = None
+        self._system_metrics_time = 0.0
     
     def record_request(self, endpoint: str, method: str, status_code: int, response_time: float):
         """Record request metrics"""
-        self.request_count[f"{method}:{endpoint}"] += 1
-        self.response_times[endpoint].append(response_time)
+        self.request_count.increment((method, endpoint))
+        self.response_times[endpoint].add(response_time)
+        self.total_requests += 1
         
         if status_code >= 400:
-            self.error_count[f"{status_code}:{endpoint}"] += 1
+            self.error_count.increment((status_code, endpoint))
+            self.total_errors += 1
     
     def record_classification(self, classification_type: str, label: str, confidence: float):
         """Record classification metrics"""
-        self.classification_stats[f"{classification_type}:{label}"] += 1
+        self.classification_stats[(classification_type, label)] += 1
     
     def get_uptime(self) -> float:
         """Get application uptime in seconds"""
         return time.time() - self.start_time
     
+    def _get_process(self) -> psutil.Process:
+        """Get the cached psutil.Process for this process"""
+        # Re-created after a fork, since a preloaded collector would
+        # otherwise keep reporting the parent process
+        pid = os.getpid()
+        if self._process is None or self._process.pid != pid:
+            self._process = psutil.Process(pid)
+            self._process.cpu_percent()  # Prime so the next call is meaningful
+            self._open_statm()
+        return self._process
+    
+    def _open_statm(self) -> None:
+        """Open this process's statm file, kept open for repeated reads"""
+        # An inherited descriptor still points at the parent's statm
+        if self._statm_fd is not None:
+            os.close(self._statm_fd)
+        
+        try:
+            self._statm_fd = os.open(PROC_STATM, os.O_RDONLY)
+        except OSError:
+            self._statm_fd = None  # Not Linux
+    
+    def _process_rss(self, process: psutil.Process) -> int:
+        """Get the resident set size in bytes"""
+        if self._statm_fd is None:
+            return process.memory_info().rss
+        
+        # Reuses one buffer and descriptor instead of opening the file each call
+        n = os.preadv(self._statm_fd, [self._statm_buf], 0)
+        return int(self._statm_buf[:n].split()[1]) * PAGE_SIZE
+    
     def get_system_metrics(self) -> dict:
-        """Get system resource metrics"""
-        process = psutil.Process(os.getpid())
+        """Get system resource metrics, cached for SYSTEM_METRICS_TTL seconds"""
+        now = time.monotonic()
+        cached = self._system_metrics
+        if cached is not None and now - self._system_metrics_time < SYSTEM_METRICS_TTL:
+            return cached
         
-        return {
-            'cpu_percent': psutil.cpu_percent(interval=1),
-            'memory_percent': psutil.virtual_memory().percent,
+        process = self._get_process()
+        process_memory_mb = self._process_rss(process) / 1024 / 1024
+        process_cpu_percent = process.cpu_percent()
+        open_files = len(process.open_files())
+        
+        # interval=None compares against the previous call instead of
+        # sleeping for a second in the request thread
+        self._system_metrics = {
+            'cpu_percent': psutil.cpu_percent(interval=None),
+            'memory_percent': memory_usage()['percent'],
             'disk_usage_percent': psutil.disk_usage('/').percent,
-            'process_memory_mb': process.memory_info().rss / 1024 / 1024,
-            'process_cpu_percent': process.cpu_percent(),
-            'open_files': len(process.open_files()),
+            'process_memory_mb': process_memory_mb,
+            'process_cpu_percent': process_cpu_percent,
+            'open_files': open_files,
         }
+        self._system_metrics_time = now
+        return self._system_metrics
+    
+    def error_rate(self) -> float:
+        """Percentage of requests that returned an error, from the running totals"""
+        total_requests = self.total_requests
+        return (self.total_errors / total_requests * 100) if total_requests > 0 else 0
     
     def get_metrics_summary(self) -> dict:
-        """Get comprehensive metrics summary"""
-        total_requests = sum(self.request_count.values())
-        total_errors = sum(self.error_count.values())
-        error_rate = (total_errors / total_requests * 100) if total_requests > 0 else 0
+        """Get comprehensive metrics summary, cached for SUMMARY_TTL seconds"""
+        now = time.monotonic()
+        if self._summary is not None and now - self._summary_time < SUMMARY_TTL:
+            return self._summary
         
-        # Calculate average response times
-        avg_response_times = {}
-        for endpoint, times in self.response_times.items():
-            if times:
-                avg_response_times[endpoint] = {
-                    'avg': sum(times) / len(times),
-                    'min': min(times),
-                    'max': max(times),
-                    'count': len(times)
-                }
+        # Average response times from the running aggregates
+        avg_response_times = {
+            endpoint: {
+                'avg': stats.total / stats.count,
+                'min': stats.min,
+                'max': stats.max,
+                'count': stats.count
+            }
+            for endpoint, stats in self.response_times.items()
+        }
         
-        return {
+        self._summary = {
             'uptime_seconds': self.get_uptime(),
-            'total_requests': total_requests,
-            'total_errors': total_errors,
-            'error_rate_percent': round(error_rate, 2),
-            'requests_by_endpoint': dict(self.request_count),
-            'errors_by_type': dict(self.error_count),
-            'classification_stats': dict(self.classification_stats),
+            'total_requests': self.total_requests,
+            'total_errors': self.total_errors,
+            'error_rate_percent': round(self.error_rate(), 2),
+            'requests_by_endpoint': _join_keys(self.request_count.to_dict()),
+            'errors_by_type': _join_keys(self.error_count.to_dict()),
+            'classification_stats': _join_keys(self.classification_stats),
             'response_times': avg_response_times,
             'system_metrics': self.get_system_metrics()
         }
+        self._summary_time = now
+        return self._summary
 
 
 # Global metrics collector instance
@@ -92,8 +277,7 @@ def monitor_requests(f):
     """Decorator to monitor request metrics"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        start_time = time.time()
-        g.start_time = start_time
+        start_ns = time.monotonic_ns()
         
         try:
             response = f(*args, **kwargs)
@@ -102,15 +286,15 @@ def monitor_requests(f):
             status_code = 500
             raise
         finally:
-            response_time = time.time() - start_time
+            elapsed_ns = time.monotonic_ns() - start_ns
             endpoint = request.endpoint or 'unknown'
             method = request.method
             
-            metrics.record_request(endpoint, method, status_code, response_time)
+            metrics.record_request(endpoint, method, status_code, elapsed_ns / 1e9)
             
             # Log slow requests
-            if response_time > 2.0:  # 2 seconds threshold
-                logger.warning(f"Slow request: {method} {endpoint} took {response_time:.3f}s")
+            if elapsed_ns > SLOW_REQUEST_NS:
+                logger.warning(f"Slow request: {method} {endpoint} took {elapsed_ns / 1e9:.3f}s")
         
         return response
     
@@ -155,13 +339,13 @@ class HealthChecker:
     @staticmethod
     def check_memory(threshold_percent: float = 90.0) -> dict:
         """Check memory usage"""
-        memory = psutil.virtual_memory()
+        memory = memory_usage()
         
         return {
-            'status': 'healthy' if memory.percent < threshold_percent else 'warning',
-            'used_percent': memory.percent,
-            'available_gb': round(memory.available / (1024**3), 2),
-            'total_gb': round(memory.total / (1024**3), 2)
+            'status': 'healthy' if memory['percent'] < threshold_percent else 'warning',
+            'used_percent': memory['percent'],
+            'available_gb': round(memory['available'] / (1024**3), 2),
+            'total_gb': round(memory['total'] / (1024**3), 2)
         }
     
     @staticmethod
@@ -174,9 +358,10 @@ class HealthChecker:
             if not os.access(upload_folder, os.R_OK | os.W_OK):
                 return {'status': 'error', 'message': 'Upload directory not accessible'}
             
-            # Check number of files in upload directory
-            file_count = len([f for f in os.listdir(upload_folder) 
-                            if os.path.isfile(os.path.join(upload_folder, f))])
+            # Check number of files in upload directory; scandir entries
+            # carry the file type, so no stat() per file is needed
+            with os.scandir(upload_folder) as entries:
+                file_count = sum(1 for entry in entries if entry.is_file())
             
             return {
                 'status': 'healthy',
@@ -197,8 +382,8 @@ class HealthChecker:
             'metrics': {
                 'status': 'healthy',
                 'uptime_hours': round(metrics.get_uptime() / 3600, 2),
-                'total_requests': sum(metrics.request_count.values()),
-                'error_rate': metrics.get_metrics_summary()['error_rate_percent']
+                'total_requests': metrics.total_requests,
+                'error_rate': round(metrics.error_rate(), 2)
             }
         }
         
@@ -221,8 +406,11 @@ class HealthChecker:
 class AlertManager:
     """Simple alert manager for critical issues"""
     
+    __slots__ = ('alert_history', 'alert_thresholds')
+    
     def __init__(self):
-        self.alert_history = []
+        # (raised_at, alert) pairs in the order they were raised
+        self.alert_history = deque()
         self.alert_thresholds = {
             'error_rate': 5.0,  # 5% error rate
             'response_time': 5.0,  # 5 seconds
@@ -230,8 +418,11 @@ class AlertManager:
             'disk_usage': 95.0,  # 95% disk usage
         }
     
-    def check_alerts(self) -> list:
+    def check_alerts(self, now: datetime = None) -> list:
         """Check for alert conditions"""
+        # One clock read stamps every alert raised in this pass
+        now = now or datetime.now()
+        timestamp = now.isoformat()
         alerts = []
         
         # Check error rate
@@ -241,7 +432,7 @@ class AlertManager:
                 'type': 'error_rate',
                 'severity': 'high',
                 'message': f"High error rate: {summary['error_rate_percent']:.2f}%",
-                'timestamp': datetime.now().isoformat()
+                'timestamp': timestamp
             })
         
         # Check system resources
@@ -251,7 +442,7 @@ class AlertManager:
                 'type': 'memory_usage',
                 'severity': 'medium',
                 'message': f"High memory usage: {system_metrics['memory_percent']:.2f}%",
-                'timestamp': datetime.now().isoformat()
+                'timestamp': timestamp
             })
         
         if system_metrics['disk_usage_percent'] > self.alert_thresholds['disk_usage']:
@@ -259,18 +450,17 @@ class AlertManager:
                 'type': 'disk_usage',
                 'severity': 'high',
                 'message': f"High disk usage: {system_metrics['disk_usage_percent']:.2f}%",
-                'timestamp': datetime.now().isoformat()
+                'timestamp': timestamp
             })
         
         # Store alert history
-        self.alert_history.extend(alerts)
+        history = self.alert_history
+        history.extend((now, alert) for alert in alerts)
         
-        # Keep only recent alerts (last 24 hours)
-        cutoff_time = datetime.now() - timedelta(hours=24)
-        self.alert_history = [
-            alert for alert in self.alert_history
-            if datetime.fromisoformat(alert['timestamp']) > cutoff_time
-        ]
+        # Keep only recent alerts (last 24 hours); the oldest are at the front
+        cutoff_time = now - timedelta(hours=24)
+        while history and history[0][0] <= cutoff_time:
+            history.popleft()
         
         return alerts
 
@@ -4,35 +4,77 @@ Security and validation utilities for EcoSort Backend API
 """
 
 import functools
+import re
 import time
 from collections import defaultdict, deque
 from typing import Dict, Any, Optional
-from flask import request, jsonify, current_app
+from flask import Response, request, current_app
 from PIL import Image
 import logging
 
+from classification_core import ojson, sniff_image_type
+
+# Accepted extensions when the app config does not set ALLOWED_EXTENSIONS
+_DEFAULT_EXTENSIONS = frozenset(('png', 'jpg', 'jpeg', 'gif'))
+
+# Largest accepted image; PIL raises DecompressionBombError for headers
+# claiming over twice this many pixels before allocating anything
+MAX_IMAGE_PIXELS = 100_000_000  # 100 megapixels
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+# Uploads below this size skip the full verify() pass
+SMALL_UPLOAD_BYTES = 64 * 1024
+
 logger = logging.getLogger(__name__)
 
 class RateLimiter:
     """Simple in-memory rate limiter"""
     
+    # Calls between sweeps of clients with no requests left in the window
+    SWEEP_INTERVAL = 10_000
+    
+    __slots__ = ('max_requests', 'window_ns', 'requests', '_calls_since_sweep')
+    
     def __init__(self, max_requests: int = 60, window_minutes: int = 1):
         self.max_requests = max_requests
-        self.window_seconds = window_minutes * 60
-        self.requests = defaultdict(deque)
+        self.window_ns = window_minutes * 60 * 1_000_000_000
+        self.requests = defaultdict(lambda: deque(maxlen=max_requests))
+        self._calls_since_sweep = 0
+    
+    def _sweep(self, now: int) -> None:
+        """Forget clients whose last request is outside the window"""
+        window_start = now - self.window_ns
+        for key, timestamps in list(self.requests.items()):
+            if not timestamps or timestamps[-1] < window_start:
+                self.requests.pop(key, None)
     
     def is_allowed(self, key: str) -> bool:
         """Check if request is allowed for given key (IP address)"""
-        now = time.time()
-        window_start = now - self.window_seconds
+        # Integer monotonic clock: unaffected by wall-clock adjustments
+        now = time.monotonic_ns()
+        
+        # Without this, one deque per client IP ever seen is kept forever
+        self._calls_since_sweep += 1
+        if self._calls_since_sweep >= self.SWEEP_INTERVAL:
+            self._calls_since_sweep = 0
+            self._sweep(now)
+        
+        timestamps = self.requests[key]
+        
+        # Fewer than max_requests timestamps in total means fewer within the
+        # window too, so old requests only need removing once it is full
+        if len(timestamps) < self.max_requests:
+            timestamps.append(now)
+            return True
         
         # Remove old requests
-        while self.requests[key] and self.requests[key][0] < window_start:
-            self.requests[key].popleft()
+        window_start = now - self.window_ns
+        while timestamps and timestamps[0] < window_start:
+            timestamps.popleft()
         
         # Check if under limit
-        if len(self.requests[key]) < self.max_requests:
-            self.requests[key].append(now)
+        if len(timestamps) < self.max_requests:
+            timestamps.append(now)
             return True
         
         return False
@@ -50,10 +92,10 @@ def rate_limit(per_minute: int = 60):
             
             if not limiter.is_allowed(client_ip):
                 logger.warning(f"Rate limit exceeded for IP: {client_ip}")
-                return jsonify({
+                return ojson({
                     'error': 'Rate limit exceeded',
                     'message': f'Maximum {per_minute} requests per minute allowed'
-                }), 429
+                }, 429)
             
             return f(*args, **kwargs)
         return wrapper
@@ -77,10 +119,10 @@ def require_api_key(f):
             return f(*args, **kwargs)
         
         logger.warning(f"Unauthorized API access attempt from {request.remote_addr}")
-        return jsonify({
+        return ojson({
             'error': 'Unauthorized',
             'message': 'Valid API key required'
-        }), 401
+        }, 401)
     
     return wrapper
 
@@ -94,30 +136,46 @@ def validate_file(file) -> Optional[str]:
         return "No file selected"
     
     # Check file extension
-    allowed_extensions = current_app.config.get('ALLOWED_EXTENSIONS', {'png', 'jpg', 'jpeg', 'gif'})
-    if not ('.' in file.filename and 
-            file.filename.rsplit('.', 1)[1].lower() in allowed_extensions):
+    allowed_extensions = current_app.config.get('ALLOWED_EXTENSIONS', _DEFAULT_EXTENSIONS)
+    _, dot, extension = file.filename.rpartition('.')
+    if not dot or extension.lower() not in allowed_extensions:
         return f"File type not allowed. Allowed types: {', '.join(allowed_extensions)}"
     
-    # Check file size
-    file.seek(0, 2)  # Seek to end
-    file_size = file.tell()
-    file.seek(0)  # Reset to beginning
-    
+    # Check file size; the request body length bounds the file size, so
+    # the file only needs measuring when the whole body is over the limit
     max_size = current_app.config.get('MAX_FILE_SIZE_BYTES', 16 * 1024 * 1024)
-    if file_size > max_size:
-        return f"File too large. Maximum size: {max_size / (1024*1024):.1f}MB"
+    content_length = request.content_length
+    file_size = content_length
+    if content_length is None or content_length > max_size:
+        file.seek(0, 2)  # Seek to end
+        file_size = file.tell()
+        file.seek(0)  # Reset to beginning
+        
+        if file_size > max_size:
+            return f"File too large. Maximum size: {max_size / (1024*1024):.1f}MB"
+    
+    # Check magic bytes before PIL parses the file
+    if sniff_image_type(file) is None:
+        return "Invalid image file"
     
     # Validate image file
     try:
         img = Image.open(file)
-        img.verify()  # Verify it's a valid image
-        file.seek(0)  # Reset file pointer
         
-        # Check image dimensions (prevent extremely large images)
-        if img.size[0] * img.size[1] > 100_000_000:  # 100 megapixels
+        # Check image dimensions from the header (prevent extremely large
+        # images) before verify() reads through the file
+        width, height = img.size
+        if width * height > MAX_IMAGE_PIXELS:
             return "Image dimensions too large"
-            
+        
+        # Small uploads are the common case; their magic bytes and header
+        # have been checked, so leave the full parse to the decode
+        if file_size >= SMALL_UPLOAD_BYTES:
+            img.verify()  # Verify it's a valid image
+        file.seek(0)  # Reset file pointer
+        
+    except Image.DecompressionBombError:
+        return "Image dimensions too large"
     except Exception as e:
         logger.warning(f"Invalid image file: {e}")
         return "Invalid image file"
@@ -125,6 +183,10 @@ def validate_file(file) -> Optional[str]:
     return None
 
 
+# Potential script injections, matched in any letter case
+_DANGEROUS_RE = re.compile(r'<script|</script|javascript:|onload=|onerror=', re.IGNORECASE)
+
+
 def sanitize_text_input(text: str) -> str:
     """Sanitize text input"""
     if not text:
@@ -133,11 +195,10 @@ def sanitize_text_input(text: str) -> str:
     # Remove dangerous characters and limit length
     text = text.strip()[:1000]  # Limit to 1000 characters
     
-    # Remove potential script injections (basic protection)
-    dangerous_patterns = ['<script', '</script', 'javascript:', 'onload=', 'onerror=']
-    for pattern in dangerous_patterns:
-        text = text.replace(pattern.lower(), '')
-        text = text.replace(pattern.upper(), '')
+    # Remove potential script injections (basic protection); every pattern
+    # contains '<', ':' or '=', so plain descriptions skip the regex
+    if '<' in text or ':' in text or '=' in text:
+        text = _DANGEROUS_RE.sub('', text)
     
     return text
 
@@ -147,14 +208,14 @@ def log_request():
     def decorator(f):
         @functools.wraps(f)
         def wrapper(*args, **kwargs):
-            start_time = time.time()
+            start_ns = time.monotonic_ns()
             
             # Log request
             logger.info(f"Request: {request.method} {request.path} from {request.remote_addr}")
             
             try:
                 response = f(*args, **kwargs)
-                duration = time.time() - start_time
+                duration = (time.monotonic_ns() - start_ns) / 1e9
                 
                 # Log response
                 status_code = getattr(response, 'status_code', 200)
@@ -162,7 +223,7 @@ def log_request():
                 
                 return response
             except Exception as e:
-                duration = time.time() - start_time
+                duration = (time.monotonic_ns() - start_ns) / 1e9
                 logger.error(f"Error in {duration:.3f}s: {str(e)}")
                 raise
         
@@ -170,16 +231,16 @@ def log_request():
     return decorator
 
 
-def create_error_response(error: str, status_code: int = 400) -> tuple:
+def create_error_response(error: str, status_code: int = 400) -> Response:
     """Create standardized error response"""
-    return jsonify({
+    return ojson({
         'error': error,
         'timestamp': time.time(),
         'status': 'error'
-    }), status_code
+    }, status_code)
 
 
-def create_success_response(data: Dict[str, Any], message: str = None) -> Dict[str, Any]:
+def create_success_response(data: Dict[str, Any], message: str = None) -> Response:
     """Create standardized success response"""
     response = {
         'status': 'success',
@@ -190,4 +251,4 @@ def create_success_response(data: Dict[str, Any], message: str = None) -> Dict[s
     if message:
         response['message'] = message
     
-    return response
\ No newline at end of file
+    return ojson(response)
\ No newline at end of file
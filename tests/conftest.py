@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+Shared pytest fixtures for EcoSort Backend API tests
+"""
+
+import os
+import pytest
+
+import classification_core
+
+
+class StubImageClassifier:
+    """Deterministic stand-in for the INT8 MobileNetV2"""
+    
+    labels = None
+    
+    def top_labels(self, img, top=5):
+        """Label every image as a bottle without running a model"""
+        return ['water_bottle']
+
+
+# PYTEST_FAST=1 gives app_production the stub instead of loading the real
+# model when it is imported, so image tests get a fixed model answer
+if os.getenv('PYTEST_FAST') == '1':
+    os.environ['USE_TENSORFLOW_MODEL'] = 'true'
+    classification_core.load_tflite_classifier = lambda *args, **kwargs: StubImageClassifier()
+
+
+def pytest_configure(config):
+    """Register the markers used by the test suite"""
+    config.addinivalue_line('markers', 'slow: runs the image model (deselect with -m "not slow")')
+
+
+@pytest.fixture(scope='session')
+def upload_dir(tmp_path_factory):
+    """Upload folder shared by the session (on tmpfs when TMPDIR=/dev/shm)"""
+    return str(tmp_path_factory.mktemp('uploads'))
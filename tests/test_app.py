@@ -3,38 +3,108 @@
 Tests for EcoSort Backend API
 """
 
+import functools
+import io
+import time
+
+import orjson
 import pytest
-import tempfile
-import os
 from PIL import Image
-import io
+from werkzeug.test import EnvironBuilder
+
+# Import the application (pytest.ini puts the repository root on sys.path)
+import app_production
+from app_production import app, config, image_cache, text_cache
+from classification_core import resize_image
+import monitoring
+from monitoring import SUMMARY_TTL, MetricsCollector, PackedCounter
+from security import RateLimiter
+
+# Text with a script injection ahead of a real description
+_DANGEROUS = '<script>alert("xss")</script>plastic bottle'
+
+
+def response_json(response):
+    """Decode a test client response body with orjson"""
+    return orjson.loads(response.data)
+
+
+@functools.lru_cache(maxsize=32)
+def _environ_template(method, path):
+    """Build the WSGI environ of a bodyless request once per (method, path)"""
+    return EnvironBuilder(method=method, path=path).get_environ()
 
-# Import the application
-import sys
-sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app_production import app
+def wsgi_call(method, path):
+    """Call the WSGI app directly with a copy of the cached environ, returning (status, body)"""
+    statuses = []
+    app_iter = app.wsgi_app(_environ_template(method, path).copy(),
+                            lambda status, headers: statuses.append(status))
+    try:
+        body = b''.join(app_iter)
+    finally:
+        app_iter.close()
+    return statuses[0], body
 
 
-@pytest.fixture
-def client():
-    """Create test client"""
+@pytest.fixture(scope='session')
+def client(upload_dir):
+    """Create test client, shared by every test in the session"""
     app.config['TESTING'] = True
-    app.config['UPLOAD_FOLDER'] = tempfile.mkdtemp()
+    app.config['UPLOAD_FOLDER'] = upload_dir
     app.config['API_KEY'] = None  # Disable API key for tests
+    # Error paths go straight to the app's error handlers
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    app.config['TRAP_HTTP_EXCEPTIONS'] = False
     
     with app.test_client() as client:
         yield client
 
 
-@pytest.fixture
-def sample_image():
-    """Create a sample image for testing"""
+@pytest.fixture(scope='session', autouse=True)
+def _warm_models(client):
+    """Run each classifier once so lazy setup is not charged to the first test"""
+    # Inputs no test uses, so the result caches stay cold for the tests
+    warm_image = io.BytesIO()
+    Image.new('RGB', (8, 8), color='blue').save(warm_image, format='PNG')
+    warm_image.seek(0)
+    
+    client.post('/classify-text', json={'text': 'warm up'})
+    client.post('/classify-image', data={'image': (warm_image, 'warm.png')})
+
+
+@pytest.fixture(autouse=True)
+def _clear_result_caches():
+    """Start every test with empty result caches so results do not depend on test order"""
+    image_cache.clear()
+    text_cache.clear()
+
+
+@pytest.fixture(scope='session')
+def sample_image_bytes():
+    """Encode a sample PNG once for the session"""
     img = Image.new('RGB', (100, 100), color='red')
     img_bytes = io.BytesIO()
     img.save(img_bytes, format='PNG')
-    img_bytes.seek(0)
-    return img_bytes
+    return img_bytes.getvalue()
+
+
+@pytest.fixture(scope='session')
+def sample_image_upload(sample_image_bytes):
+    """Encode the sample image as a multipart body once, as (body, content_type)"""
+    environ = EnvironBuilder(method='POST', data={
+        'image': (io.BytesIO(sample_image_bytes), 'test.png')
+    }).get_environ()
+    return environ['wsgi.input'].read(), environ['CONTENT_TYPE']
+
+
+@pytest.fixture(scope='class')
+def image_result(client, sample_image_upload):
+    """Classify the sample image once per test class, as (response, data)"""
+    image_cache.clear()
+    body, content_type = sample_image_upload
+    response = client.post('/classify-image', data=body, content_type=content_type)
+    return response, response_json(response)
 
 
 class TestHealthEndpoints:
@@ -42,136 +112,185 @@ class TestHealthEndpoints:
     
     def test_health_check(self, client):
         """Test main health check endpoint"""
-        response = client.get('/')
-        assert response.status_code == 200
+        status, body = wsgi_call('GET', '/')
+        assert status == '200 OK'
         
-        data = response.get_json()
+        data = orjson.loads(body)
         assert data['status'] == 'success'
         assert data['data']['service'] == 'EcoSort AI Waste Classifier'
         assert 'version' in data['data']
     
     def test_readiness_probe(self, client):
         """Test Kubernetes readiness probe"""
-        response = client.get('/health/ready')
-        assert response.status_code == 200
+        status, body = wsgi_call('GET', '/health/ready')
+        assert status == '200 OK'
         
-        data = response.get_json()
+        data = orjson.loads(body)
         assert data['status'] == 'ready'
     
     def test_liveness_probe(self, client):
         """Test Kubernetes liveness probe"""
-        response = client.get('/health/live')
-        assert response.status_code == 200
+        status, body = wsgi_call('GET', '/health/live')
+        assert status == '200 OK'
         
-        data = response.get_json()
+        data = orjson.loads(body)
         assert data['status'] == 'alive'
 
 
 class TestTextClassification:
     """Test text classification endpoint"""
     
-    def test_classify_text_success(self, client):
+    @pytest.mark.parametrize('text,label', [
+        ('plastic bottle', 'recyclable'),
+        ('aluminum can', 'recyclable'),
+        ('battery acid', 'hazardous'),
+    ])
+    def test_classify_text(self, client, text, label):
         """Test successful text classification"""
-        response = client.post('/classify-text', 
-                             json={'text': 'plastic bottle'})
+        response = client.post('/classify-text', json={'text': text})
         assert response.status_code == 200
         
-        data = response.get_json()
+        data = response_json(response)
         assert data['status'] == 'success'
-        assert 'label' in data['data']
         assert 'confidence' in data['data']
         assert 'tip' in data['data']
-        assert data['data']['label'] in ['recyclable', 'biodegradable', 'hazardous']
-    
-    def test_classify_text_no_data(self, client):
-        """Test text classification without data"""
-        response = client.post('/classify-text', json={})
-        assert response.status_code == 400
-        
-        data = response.get_json()
-        assert data['status'] == 'error'
-        assert 'No text provided' in data['error']
-    
-    def test_classify_text_empty(self, client):
-        """Test text classification with empty text"""
-        response = client.post('/classify-text', json={'text': ''})
-        assert response.status_code == 400
-        
-        data = response.get_json()
-        assert data['status'] == 'error'
+        assert data['data']['label'] == label
     
-    def test_classify_text_recyclable(self, client):
-        """Test classification of recyclable items"""
-        response = client.post('/classify-text', 
-                             json={'text': 'aluminum can'})
+    def test_classify_text_whole_words(self, client):
+        """Test keywords match whole words and their plurals"""
+        response = client.post('/classify-text',
+                             json={'text': 'old batteries in a canister by the toilet'})
         assert response.status_code == 200
         
-        data = response.get_json()
-        assert data['data']['label'] == 'recyclable'
+        data = response_json(response)
+        assert data['data']['label'] == 'hazardous'
+        assert data['data']['confidence'] == 0.95
     
-    def test_classify_text_hazardous(self, client):
-        """Test classification of hazardous items"""
-        response = client.post('/classify-text', 
-                             json={'text': 'battery acid'})
-        assert response.status_code == 200
+    def test_classify_text_cached(self, client):
+        """Test repeated text is served from the result cache"""
+        first = client.post('/classify-text', json={'text': 'Glass Jar'})
+        hits = text_cache.hits
+        second = client.post('/classify-text', json={'text': 'glass jar'})
         
-        data = response.get_json()
-        assert data['data']['label'] == 'hazardous'
+        assert text_cache.hits == hits + 1
+        assert response_json(second)['data']['label'] == response_json(first)['data']['label']
 
 
 class TestImageClassification:
     """Test image classification endpoint"""
     
-    def test_classify_image_success(self, client, sample_image):
+    @pytest.mark.slow
+    def test_classify_image_success(self, image_result):
         """Test successful image classification"""
-        response = client.post('/classify-image',
-                             data={'image': (sample_image, 'test.png')})
+        response, data = image_result
         assert response.status_code == 200
-        
-        data = response.get_json()
         assert data['status'] == 'success'
-        assert 'label' in data['data']
-        assert 'confidence' in data['data']
-        assert 'tip' in data['data']
-        assert 'image_info' in data['data']
     
-    def test_classify_image_no_file(self, client):
-        """Test image classification without file"""
-        response = client.post('/classify-image', data={})
-        assert response.status_code == 400
+    @pytest.mark.slow
+    def test_classify_image_result(self, image_result):
+        """Test image classification returns a label, confidence and tip"""
+        _, data = image_result
+        assert data['data']['label'] in ['recyclable', 'biodegradable', 'hazardous']
+        assert 0 < data['data']['confidence'] <= 1
+        assert data['data']['tip']
+    
+    @pytest.mark.slow
+    def test_classify_image_info(self, image_result):
+        """Test image classification reports the uploaded image details"""
+        _, data = image_result
+        assert data['data']['image_info'] == {
+            'filename': 'test.png',
+            'size': '100x100',
+            'format': 'PNG'
+        }
+    
+    def test_classify_image_info_before_draft(self, client, monkeypatch):
+        """Test the reported size is the upload's, not the JPEG draft-mode size"""
+        class DraftingClassifier:
+            def top_labels(self, img):
+                resize_image(img)
+                return ['water_bottle']
         
-        data = response.get_json()
-        assert data['status'] == 'error'
-        assert 'No image file provided' in data['error']
+        monkeypatch.setattr(app_production, 'image_classifier', DraftingClassifier())
+        upload = io.BytesIO()
+        Image.new('RGB', (1000, 800), color='green').save(upload, format='JPEG')
+        upload.seek(0)
+        
+        response = client.post('/classify-image', data={'image': (upload, 'large.jpg')})
+        assert response.status_code == 200
+        
+        data = response_json(response)
+        assert data['data']['label'] == 'recyclable'
+        assert data['data']['image_info']['size'] == '1000x800'
     
-    def test_classify_image_invalid_format(self, client):
-        """Test image classification with invalid file format"""
-        response = client.post('/classify-image',
-                             data={'image': (io.BytesIO(b'not an image'), 'test.txt')})
-        assert response.status_code == 400
+    def test_classify_image_failure_not_cached(self, client, sample_image_upload, monkeypatch):
+        """Test a failed classification gets the fallback answer without being cached"""
+        class FailingClassifier:
+            def top_labels(self, img):
+                raise TimeoutError('model timed out')
         
-        data = response.get_json()
-        assert data['status'] == 'error'
+        monkeypatch.setattr(app_production, 'image_classifier', FailingClassifier())
+        body, content_type = sample_image_upload
+        response = client.post('/classify-image', data=body, content_type=content_type)
+        assert response.status_code == 200
+        
+        data = response_json(response)
+        assert (data['data']['label'], data['data']['confidence']) == ('recyclable', 0.30)
+        assert image_cache.stats()['size'] == 0
+    
+    def test_classify_image_heuristic_not_cached(self, client, sample_image_upload, monkeypatch):
+        """Test the random heuristic's placeholder answers are not cached"""
+        monkeypatch.setattr(app_production, 'image_classifier', None)
+        body, content_type = sample_image_upload
+        response = client.post('/classify-image', data=body, content_type=content_type)
+        assert response.status_code == 200
+        assert image_cache.stats()['size'] == 0
+    
+    def test_classify_image_model_cached(self, client, sample_image_upload, monkeypatch):
+        """Test model answers are cached by content hash"""
+        class BottleClassifier:
+            def top_labels(self, img):
+                return ['water_bottle']
+        
+        monkeypatch.setattr(app_production, 'image_classifier', BottleClassifier())
+        body, content_type = sample_image_upload
+        client.post('/classify-image', data=body, content_type=content_type)
+        hits = image_cache.hits
+        response = client.post('/classify-image', data=body, content_type=content_type)
+        
+        assert image_cache.hits == hits + 1
+        assert response_json(response)['data']['label'] == 'recyclable'
 
 
 class TestErrorHandling:
     """Test error handling"""
     
-    def test_404_endpoint(self, client):
-        """Test 404 error handling"""
-        response = client.get('/nonexistent')
-        assert response.status_code == 404
+    @pytest.mark.parametrize('method,path,kwargs,status_code,message', [
+        ('get', '/nonexistent', {}, 404, 'not found'),
+        ('post', '/classify-text', {'json': {}}, 400, 'no text provided'),
+        ('post', '/classify-text', {'json': {'text': ''}}, 400, 'empty'),
+        ('post', '/classify-text', {'data': 'invalid json', 'content_type': 'application/json'},
+         400, 'invalid json body'),
+        ('post', '/classify-image', {'data': {}}, 400, 'no image file provided'),
+        ('post', '/classify-image', {'data': {'image': (b'not an image', 'test.txt')}},
+         400, 'file type not allowed'),
+        # Non-image content behind an image extension
+        ('post', '/classify-image', {'data': {'image': (b'MZ\x90\x00not an image', 'test.png')}},
+         400, 'invalid image file'),
+    ])
+    def test_error_response(self, client, method, path, kwargs, status_code, message):
+        """Test error paths return the error status and message"""
+        if 'image' in kwargs.get('data', {}):
+            # Fresh upload stream for every run
+            content, filename = kwargs['data']['image']
+            kwargs = {'data': {'image': (io.BytesIO(content), filename)}}
         
-        data = response.get_json()
+        response = getattr(client, method)(path, **kwargs)
+        assert response.status_code == status_code
+        
+        data = response_json(response)
         assert data['status'] == 'error'
-        assert 'not found' in data['error'].lower()
-    
-    def test_invalid_json(self, client):
-        """Test invalid JSON handling"""
-        response = client.post('/classify-text',
-                             data='invalid json',
-                             content_type='application/json')
-        assert response.status_code == 400
+        assert message in data['error'].lower()
 
 
 class TestSecurity:
@@ -179,26 +298,98 @@ class TestSecurity:
     
     def test_cors_headers(self, client):
         """Test CORS headers are present"""
-        response = client.get('/')
-        # In a real test, you'd check for actual CORS headers
+        origin = config.CORS_ORIGINS[0]
+        response = client.head('/', headers={'Origin': origin})
         assert response.status_code == 200
+        assert response.headers['Access-Control-Allow-Origin'] == origin
     
     def test_rate_limiting_disabled_in_tests(self, client):
         """Test that rate limiting doesn't interfere with tests"""
-        # Make multiple requests quickly
-        for _ in range(5):
-            response = client.get('/')
-            assert response.status_code == 200
+        # Make multiple requests quickly, straight through the WSGI app
+        statuses = [wsgi_call('GET', '/')[0] for _ in range(5)]
+        assert statuses == ['200 OK'] * 5
     
     def test_text_sanitization(self, client):
         """Test that dangerous text is sanitized"""
-        dangerous_text = '<script>alert("xss")</script>plastic bottle'
-        response = client.post('/classify-text', json={'text': dangerous_text})
+        response = client.post('/classify-text', json={'text': _DANGEROUS})
         assert response.status_code == 200
         
-        data = response.get_json()
-        # Check that script tags are removed
-        assert '<script>' not in data['data'].get('input_text', '')
+        # Check that script tags are removed, without decoding the JSON
+        assert b'<script>' not in response.data
+
+
+class TestRateLimiter:
+    """Test the in-memory rate limiter"""
+    
+    @pytest.fixture
+    def clock(self, monkeypatch):
+        """Fake monotonic clock, advanced by setting clock[0] in nanoseconds"""
+        clock = [0]
+        monkeypatch.setattr(time, 'monotonic_ns', lambda: clock[0])
+        return clock
+    
+    def test_limit_expires_with_window(self, clock):
+        """Test requests are refused at the limit and allowed once the window passes"""
+        limiter = RateLimiter(max_requests=2, window_minutes=1)
+        assert limiter.is_allowed('10.0.0.1')
+        assert limiter.is_allowed('10.0.0.1')
+        assert not limiter.is_allowed('10.0.0.1')
+        assert limiter.is_allowed('10.0.0.2')
+        
+        clock[0] += limiter.window_ns + 1
+        assert limiter.is_allowed('10.0.0.1')
+    
+    def test_sweep_forgets_idle_clients(self, clock, monkeypatch):
+        """Test the periodic sweep drops clients with nothing left in the window"""
+        monkeypatch.setattr(RateLimiter, 'SWEEP_INTERVAL', 3)
+        limiter = RateLimiter(max_requests=5, window_minutes=1)
+        limiter.is_allowed('idle')
+        
+        clock[0] += limiter.window_ns + 1
+        limiter.is_allowed('active')
+        assert 'idle' in limiter.requests
+        
+        limiter.is_allowed('active')
+        assert 'idle' not in limiter.requests
+        assert len(limiter.requests['active']) == 2
+
+
+class TestMetrics:
+    """Test metrics collection"""
+    
+    def test_packed_counter_grows(self):
+        """Test counters keep their counts when the array grows past its capacity"""
+        counter = PackedCounter(capacity=2)
+        for key in ('a', 'b', 'c', 'a', 'c', 'c'):
+            counter.increment(key)
+        
+        assert counter.to_dict() == {'a': 2, 'b': 1, 'c': 3}
+    
+    def test_metrics_summary(self, monkeypatch):
+        """Test the summary totals, joined keys and response times, and its TTL cache"""
+        collector = MetricsCollector()
+        collector.record_request('classify_text_endpoint', 'POST', 200, 0.1)
+        collector.record_request('classify_text_endpoint', 'POST', 400, 0.3)
+        collector.record_classification('text', 'recyclable', 0.9)
+        
+        summary = collector.get_metrics_summary()
+        assert summary['total_requests'] == 2
+        assert summary['total_errors'] == 1
+        assert summary['error_rate_percent'] == 50.0
+        assert summary['requests_by_endpoint'] == {'POST:classify_text_endpoint': 2}
+        assert summary['errors_by_type'] == {'400:classify_text_endpoint': 1}
+        assert summary['classification_stats'] == {'text:recyclable': 1}
+        assert summary['response_times']['classify_text_endpoint'] == pytest.approx(
+            {'avg': 0.2, 'min': 0.1, 'max': 0.3, 'count': 2}
+        )
+        
+        # Served from the cache until SUMMARY_TTL has passed
+        collector.record_request('classify_text_endpoint', 'POST', 200, 0.2)
+        assert collector.get_metrics_summary() is summary
+        
+        now = time.monotonic()
+        monkeypatch.setattr(monitoring.time, 'monotonic', lambda: now + SUMMARY_TTL)
+        assert collector.get_metrics_summary()['total_requests'] == 3
 
 
 if __name__ == '__main__':